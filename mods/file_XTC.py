@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import os
+import errno
+import time
+import struct
+import threading
+import queue
+
+
+
+# =============== constant =============== #
+XTC_MAGIC = 1995
+XTC_NEW_MAGIC = 2023
+XTC_HEADER_SIZE = 56
+XTC_COMPRESSED_HEADER_SIZE = 32
+XTC_MAX_UNCOMPRESSED_ATOMS = 9
+BATCH_SIZE = 4 * 1024 * 1024
+QUEUE_SIZE = 16
+WAIT_INTERVAL = 0.1
+
+
+
+# =============== class =============== #
+class FileXTC:
+	""" FileXTC class (multi-part .xtc files read as one stream) """
+	def __init__(self, input_files):
+		# member variables
+		self._input_files = input_files
+		self._n_duplicate = 0
+		self._n_incomplete = 0
+		self._error = None
+		self._flag_opened = False
+		self._obj_stop = threading.Event()
+
+
+	@property
+	def n_duplicate(self):
+		""" Number of frames dropped as duplicated time """
+		return self._n_duplicate
+
+
+	@property
+	def n_incomplete(self):
+		""" Number of incomplete frames dropped at the end of parts """
+		return self._n_incomplete
+
+
+	@property
+	def error(self):
+		""" Exception raised while reading parts (None if succeeded) """
+		return self._error
+
+
+	@property
+	def flag_opened(self):
+		""" Whether output was opened by the reader """
+		return self._flag_opened
+
+
+	def _read_frame(self, obj_input):
+		"""
+		Method to read a frame as raw bytes (incomplete frame at the end of file is dropped)
+
+		Args:
+			obj_input (file): binary file object
+
+		Returns:
+			tuple: (time (float), raw bytes of frame) or None at the end of file
+
+		Raises:
+			ValueError: invalid magic number
+		"""
+		header = obj_input.read(XTC_HEADER_SIZE)
+		if len(header) == 0:
+			return None
+		if len(header) < XTC_HEADER_SIZE:
+			return self._drop_incomplete(obj_input)
+
+		magic, n_atom = struct.unpack(">ii", header[0:8])
+		if magic not in [XTC_MAGIC, XTC_NEW_MAGIC]:
+			raise ValueError("invalid magic number is found in {0}.".format(obj_input.name))
+		frame_time = struct.unpack(">f", header[12:16])[0]
+
+		if n_atom <= XTC_MAX_UNCOMPRESSED_ATOMS:
+			body_size = n_atom * 3 * 4
+			body = obj_input.read(body_size)
+			if len(body) < body_size:
+				return self._drop_incomplete(obj_input)
+		else:
+			count_size = 8 if magic == XTC_NEW_MAGIC else 4
+			body = obj_input.read(XTC_COMPRESSED_HEADER_SIZE + count_size)
+			if len(body) < XTC_COMPRESSED_HEADER_SIZE + count_size:
+				return self._drop_incomplete(obj_input)
+			if magic == XTC_NEW_MAGIC:
+				byte_count = struct.unpack(">q", body[XTC_COMPRESSED_HEADER_SIZE:])[0]
+			else:
+				byte_count = struct.unpack(">i", body[XTC_COMPRESSED_HEADER_SIZE:])[0]
+			payload_size = (byte_count + 3) // 4 * 4
+			payload = obj_input.read(payload_size)
+			if len(payload) < payload_size:
+				return self._drop_incomplete(obj_input)
+			body += payload
+
+		return (frame_time, header + body)
+
+
+	def _drop_incomplete(self, obj_input):
+		"""
+		Method to warn about incomplete frame at the end of file
+
+		Args:
+			obj_input (file): binary file object
+
+		Returns:
+			None
+		"""
+		sys.stderr.write("WARN: incomplete last frame in {0} is dropped.\n".format(obj_input.name))
+		self._n_incomplete += 1
+		return None
+
+
+	def iter_frames(self):
+		"""
+		Method to yield frames of all parts, dropping frames whose time is not later than the previous frame
+
+		Returns:
+			generator: (time (float), raw bytes of frame)
+		"""
+		self._n_duplicate = 0
+		self._n_incomplete = 0
+		last_time = None
+		for input_file in self._input_files:
+			n_frame = 0
+			n_output = 0
+			flag_backward = False
+			with open(input_file, "rb") as obj_input:
+				while True:
+					frame = self._read_frame(obj_input)
+					if frame is None:
+						break
+					n_frame += 1
+					if last_time is not None and frame[0] <= last_time:
+						if frame[0] < last_time and not flag_backward:
+							# not a duplicated frame at restart boundary
+							sys.stderr.write("WARN: time goes backward in {0} ({1} ps after {2} ps). Frames not later than {2} ps are dropped.\n".format(input_file, frame[0], last_time))
+							flag_backward = True
+						self._n_duplicate += 1
+						continue
+					last_time = frame[0]
+					n_output += 1
+					yield frame
+
+			if n_frame != 0 and n_output == 0:
+				sys.stderr.write("WARN: all frames in {0} are dropped (time is not later than {1} ps).\n".format(input_file, last_time))
+
+
+	def _prefetch(self, obj_queue):
+		"""
+		Method to read frames into the queue (run on background thread)
+
+		Args:
+			obj_queue (queue.Queue): queue for raw bytes (None at the end, exception when reading failed)
+		"""
+		try:
+			batch = []
+			batch_size = 0
+			for _, frame_bytes in self.iter_frames():
+				batch.append(frame_bytes)
+				batch_size += len(frame_bytes)
+				if batch_size < BATCH_SIZE:
+					continue
+				if not self._put(obj_queue, b"".join(batch)):
+					return
+				batch = []
+				batch_size = 0
+			if len(batch) != 0:
+				if not self._put(obj_queue, b"".join(batch)):
+					return
+			self._put(obj_queue, None)
+
+		except Exception as e:
+			# pass exception to the writer thread
+			self._put(obj_queue, e)
+
+
+	def _put(self, obj_queue, value):
+		"""
+		Method to put value into the queue until stop event is set
+
+		Args:
+			obj_queue (queue.Queue): queue for raw bytes
+			value (bytes, None or Exception): value to put
+
+		Returns:
+			bool: False if stopped
+		"""
+		while not self._obj_stop.is_set():
+			try:
+				obj_queue.put(value, timeout=WAIT_INTERVAL)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+
+	def _get(self, obj_queue):
+		"""
+		Method to get value from the queue until stop event is set
+
+		Args:
+			obj_queue (queue.Queue): queue for raw bytes
+
+		Returns:
+			bytes, None or Exception: None if stopped or at the end
+		"""
+		while not self._obj_stop.is_set():
+			try:
+				return obj_queue.get(timeout=WAIT_INTERVAL)
+			except queue.Empty:
+				continue
+		return None
+
+
+	def _open_output(self, output_file):
+		"""
+		Method to open output without blocking until the reader of named pipe appears
+
+		Args:
+			output_file (str): output file path
+
+		Returns:
+			file: binary file object (None if stopped)
+		"""
+		while not self._obj_stop.is_set():
+			try:
+				fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NONBLOCK)
+			except OSError as e:
+				if e.errno == errno.ENXIO:
+					# no reader opens named pipe yet
+					time.sleep(WAIT_INTERVAL)
+					continue
+				raise
+			os.set_blocking(fd, True)
+			self._flag_opened = True
+			return os.fdopen(fd, "wb")
+		return None
+
+
+	def stop(self):
+		"""
+		Method to stop output (call after the reader finished)
+
+		Returns:
+			self
+		"""
+		self._obj_stop.set()
+		return self
+
+
+	def _reset(self):
+		"""
+		Method to reset state before output
+		"""
+		self._error = None
+		self._flag_opened = False
+		self._obj_stop.clear()
+
+
+	def _output_xtc(self, output_file):
+		"""
+		Method to output concatenated .xtc file without resetting state
+
+		Args:
+			output_file (str): output file path
+		"""
+		obj_queue = queue.Queue(maxsize=QUEUE_SIZE)
+		obj_thread = threading.Thread(target=self._prefetch, args=(obj_queue,), daemon=True)
+		obj_thread.start()
+
+		try:
+			obj_output = self._open_output(output_file)
+			if obj_output is not None:
+				with obj_output:
+					while True:
+						data = self._get(obj_queue)
+						if data is None:
+							break
+						if isinstance(data, Exception):
+							self._error = data
+							break
+						obj_output.write(data)
+		except BrokenPipeError:
+			# reader (gmx) stopped reading before the end of trajectory
+			pass
+		except Exception as e:
+			self._error = e
+		finally:
+			self._obj_stop.set()
+
+
+	def output_xtc(self, output_file):
+		"""
+		Method to output concatenated .xtc file (output_file may be named pipe)
+
+		Args:
+			output_file (str): output file path
+
+		Returns:
+			self
+		"""
+		self._reset()
+		self._output_xtc(output_file)
+		return self
+
+
+	def start_output_xtc(self, output_file):
+		"""
+		Method to output concatenated .xtc file on background thread
+
+		Args:
+			output_file (str): output file path
+
+		Returns:
+			threading.Thread: started thread
+		"""
+		# reset on the caller thread, so that stop() just after this method is not overwritten
+		self._reset()
+		obj_thread = threading.Thread(target=self._output_xtc, args=(output_file,), daemon=True)
+		obj_thread.start()
+		return obj_thread
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AMBER NetCDF trajectory function module
+"""
+
+import sys
+import os
+import struct
+import numpy as np
+import parmed
+from scipy.io import netcdf_file
+
+
+
+# =============== constant =============== #
+CHUNK_SIZE = 100
+ANGLE_TOLERANCE = 1.0e-3
+NUMRECS_OFFSET = 4
+
+
+
+# =============== function =============== #
+def check_nc_convertible(input_file):
+	"""
+	Function to check whether the trajectory can be processed in-process (NetCDF3 file with no box or orthogonal box)
+
+	Args:
+		input_file (str): AMBER NetCDF trajectory file
+
+	Returns:
+		bool
+	"""
+	try:
+		obj_nc = netcdf_file(input_file, "r", mmap=True)
+	except TypeError:
+		# scipy only supports NetCDF3 (NetCDF4/HDF5 file is rejected)
+		sys.stderr.write("WARN: {0} is not NetCDF3 file. cpptraj is used for conversion.\n".format(input_file))
+		return False
+
+	try:
+		if "cell_angles" not in obj_nc.variables:
+			return True
+		cell_angles = np.array(obj_nc.variables["cell_angles"][:], dtype=np.float64)
+		if np.all(np.abs(cell_angles - 90.0) < ANGLE_TOLERANCE):
+			return True
+		sys.stderr.write("WARN: non-orthogonal box is found in {0}. cpptraj is used for conversion.\n".format(input_file))
+		return False
+	finally:
+		obj_nc.close()
+
+
+def get_molecule_index(obj_topol):
+	"""
+	Function to return molecule index for each atom
+
+	Args:
+		obj_topol (parmed.Structure): topology
+
+	Returns:
+		ndarray: molecule index for each atom
+	"""
+	parents = list(range(len(obj_topol.atoms)))
+
+	def find_root(atom_idx):
+		while parents[atom_idx] != atom_idx:
+			parents[atom_idx] = parents[parents[atom_idx]]
+			atom_idx = parents[atom_idx]
+		return atom_idx
+
+	for obj_bond in obj_topol.bonds:
+		root1 = find_root(obj_bond.atom1.idx)
+		root2 = find_root(obj_bond.atom2.idx)
+		if root1 != root2:
+			parents[max(root1, root2)] = min(root1, root2)
+
+	roots = np.array([find_root(i) for i in range(len(parents))], dtype=np.int64)
+	return np.unique(roots, return_inverse=True)[1]
+
+
+def get_periodic_shift(vectors, cell_lengths):
+	"""
+	Function to return the multiple of cell lengths nearest to vectors (dimensions with zero cell length are treated as non-periodic)
+
+	Args:
+		vectors (ndarray): vectors (... x 3)
+		cell_lengths (ndarray): cell lengths broadcastable to vectors
+
+	Returns:
+		ndarray: shift
+	"""
+	flag_periodic = cell_lengths > 0.0
+	safe_lengths = np.where(flag_periodic, cell_lengths, 1.0)
+	return np.where(flag_periodic, safe_lengths * np.round(vectors / safe_lengths), 0.0)
+
+
+def unwrap_atoms(coords, cell_lengths, previous):
+	"""
+	Function to unwrap atoms across the periodic boundary relative to the previous frame
+
+	Args:
+		coords (ndarray): coordinates of target atoms (frame x atom x 3)
+		cell_lengths (ndarray): cell lengths (frame x 3)
+		previous (ndarray or None): unwrapped coordinates in the previous frame (atom x 3)
+
+	Returns:
+		ndarray: unwrapped coordinates in the last frame
+	"""
+	for frame_i in range(coords.shape[0]):
+		if previous is not None:
+			displacement = coords[frame_i] - previous
+			displacement -= get_periodic_shift(displacement, cell_lengths[frame_i])
+			coords[frame_i] = previous + displacement
+		previous = coords[frame_i]
+	return previous
+
+
+def image_molecules(coords, cell_lengths, masses, molecule_index, n_molecule):
+	"""
+	Function to image molecules by their center of mass into the box centered at the origin
+
+	Args:
+		coords (ndarray): coordinates (frame x atom x 3)
+		cell_lengths (ndarray): cell lengths (frame x 3)
+		masses (ndarray): atomic masses
+		molecule_index (ndarray): molecule index for each atom
+		n_molecule (int): number of molecules
+
+	Returns:
+		ndarray: imaged coordinates
+	"""
+	coords_t = coords.transpose(1, 0, 2)
+	mol_mass = np.bincount(molecule_index, weights=masses, minlength=n_molecule)
+	mol_mass[mol_mass == 0.0] = 1.0
+	order = np.argsort(molecule_index, kind="stable")
+	boundaries = np.searchsorted(molecule_index[order], np.arange(n_molecule))
+	mol_center = np.add.reduceat((coords_t * masses[:, None, None])[order], boundaries, axis=0)
+	mol_center /= mol_mass[:, None, None]
+
+	shift = -get_periodic_shift(mol_center, cell_lengths[None, :, :])
+	return (coords_t + shift[molecule_index]).transpose(1, 0, 2)
+
+
+def fit_frames(coords, fit_index, weights, reference):
+	"""
+	Function to superimpose frames on the reference by mass-weighted RMS fitting
+
+	Args:
+		coords (ndarray): coordinates (frame x atom x 3)
+		fit_index (ndarray): atom index for fitting
+		weights (ndarray): mass weights for fitting atoms
+		reference (ndarray): reference coordinates of fitting atoms (atom x 3)
+
+	Returns:
+		ndarray: fitted coordinates
+	"""
+	weights = weights / np.sum(weights)
+	ref_center = np.sum(reference * weights[:, None], axis=0)
+	ref_coords = reference - ref_center
+
+	mobile = coords[:, fit_index]
+	mob_center = np.einsum("fai,a->fi", mobile, weights)
+	mobile = mobile - mob_center[:, None, :]
+
+	covariance = np.einsum("fai,a,aj->fij", mobile, weights, ref_coords)
+	u, _, vt = np.linalg.svd(covariance)
+	v = vt.transpose(0, 2, 1)
+	sign = np.sign(np.linalg.det(np.matmul(v, u.transpose(0, 2, 1))))
+	sign[sign == 0.0] = 1.0
+	v[:, :, 2] *= sign[:, None]
+	rotation = np.matmul(v, u.transpose(0, 2, 1))
+
+	return np.einsum("fai,fji->faj", coords - mob_center[:, None, :], rotation) + ref_center
+
+
+def create_nc(output_file, n_atom, flag_box, flag_time):
+	"""
+	Function to create AMBER NetCDF trajectory file whose frames are written afterwards as raw records
+
+	scipy writes record variables only on close, so the header is written by scipy with a dummy frame,
+	and frames are overwritten from the offset of the first record.
+
+	Args:
+		output_file (str): output AMBER NetCDF trajectory file
+		n_atom (int): number of atoms
+		flag_box (bool): output cell lengths and angles
+		flag_time (bool): output time
+
+	Returns:
+		tuple: (offset of the first record (int), numpy dtype of a record)
+	"""
+	obj_output = netcdf_file(output_file, "w", version=2)
+	obj_output.Conventions = "AMBER"
+	obj_output.ConventionVersion = "1.0"
+	obj_output.program = "trr2nc"
+	obj_output.programVersion = "1.0"
+	obj_output.title = "trr2nc"
+
+	obj_output.createDimension("frame", None)
+	obj_output.createDimension("spatial", 3)
+	obj_output.createDimension("atom", n_atom)
+	var = obj_output.createVariable("spatial", "c", ("spatial",))
+	var[:] = np.array(list(b"xyz"), dtype=np.uint8).view("S1")
+	if flag_box:
+		obj_output.createDimension("cell_spatial", 3)
+		obj_output.createDimension("cell_angular", 3)
+		obj_output.createDimension("label", 5)
+		var = obj_output.createVariable("cell_spatial", "c", ("cell_spatial",))
+		var[:] = np.array(list(b"abc"), dtype=np.uint8).view("S1")
+		var = obj_output.createVariable("cell_angular", "c", ("cell_angular", "label"))
+		var[:] = np.array([list(b"alpha"), list(b"beta "), list(b"gamma")], dtype=np.uint8).view("S1")
+
+	# record variables (written in this order in each record)
+	record_fields = []
+	if flag_time:
+		var = obj_output.createVariable("time", "f", ("frame",))
+		var.units = "picosecond"
+		var[0] = 0.0
+		record_fields.append(("time", ">f4"))
+	var = obj_output.createVariable("coordinates", "f", ("frame", "atom", "spatial"))
+	var.units = "angstrom"
+	var[0] = np.zeros((n_atom, 3), dtype=np.float32)
+	record_fields.append(("coordinates", ">f4", (n_atom, 3)))
+	if flag_box:
+		var = obj_output.createVariable("cell_lengths", "d", ("frame", "cell_spatial"))
+		var.units = "angstrom"
+		var[0] = np.zeros(3)
+		record_fields.append(("cell_lengths", ">f8", (3,)))
+		var = obj_output.createVariable("cell_angles", "d", ("frame", "cell_angular"))
+		var.units = "degree"
+		var[0] = np.zeros(3)
+		record_fields.append(("cell_angles", ">f8", (3,)))
+	var = None
+	obj_output.close()
+
+	record_dtype = np.dtype(record_fields)
+	return (os.path.getsize(output_file) - record_dtype.itemsize, record_dtype)
+
+
+def convert_nc(obj_topol, input_file, output_file, center_mask, strip_mask=None, chunk_size=CHUNK_SIZE):
+	"""
+	Function to unwrap, center, image, fit and strip AMBER NetCDF trajectory without cpptraj
+
+	Args:
+		obj_topol (parmed.Structure): topology before stripping
+		input_file (str): input AMBER NetCDF trajectory file
+		output_file (str): output AMBER NetCDF trajectory file
+		center_mask (str): AmberMask for centering and fitting
+		strip_mask (str, optional): AmberMask for stripping (Default: None)
+		chunk_size (int, optional): number of frames read at once (Default: CHUNK_SIZE)
+
+	Returns:
+		int: number of frames
+	"""
+	n_atom = len(obj_topol.atoms)
+	masses = np.array([obj_atom.mass for obj_atom in obj_topol.atoms], dtype=np.float64)
+	center_index = np.array(list(parmed.amber.AmberMask(obj_topol, center_mask).Selected()), dtype=np.int64)
+	if len(center_index) == 0:
+		sys.stderr.write("ERROR: no atoms are selected by center mask ({0}).\n".format(center_mask))
+		sys.exit(1)
+	center_weights = masses[center_index]
+	keep_index = np.arange(n_atom)
+	if strip_mask is not None:
+		keep_index = np.setdiff1d(keep_index, np.array(list(parmed.amber.AmberMask(obj_topol, strip_mask).Selected()), dtype=np.int64))
+	molecule_index = get_molecule_index(obj_topol)
+	n_molecule = int(np.max(molecule_index)) + 1 if n_atom != 0 else 0
+
+	obj_input = netcdf_file(input_file, "r", mmap=True)
+	obj_output = None
+	try:
+		var_coords = obj_input.variables["coordinates"]
+		n_frame = var_coords.shape[0]
+		if var_coords.shape[1] != n_atom:
+			sys.stderr.write("ERROR: number of atoms in {0} ({1}) does not match the topology ({2}).\n".format(input_file, var_coords.shape[1], n_atom))
+			sys.exit(1)
+		flag_box = "cell_lengths" in obj_input.variables
+		flag_time = "time" in obj_input.variables
+
+		record_offset, record_dtype = create_nc(output_file, len(keep_index), flag_box, flag_time)
+		obj_output = open(output_file, "r+b")
+		obj_output.seek(record_offset)
+
+		previous = None
+		reference = None
+		for start_i in range(0, n_frame, chunk_size):
+			end_i = min(start_i + chunk_size, n_frame)
+			sys.stderr.write("\rINFO: Processing frames {0}-{1} / {2} ... ".format(start_i + 1, end_i, n_frame))
+			sys.stderr.flush()
+
+			# copy slab out of the memory-mapped file
+			coords = np.array(var_coords[start_i:end_i], dtype=np.float64)
+			cell_lengths = None
+			cell_angles = None
+			times = None
+			if flag_time:
+				times = np.array(obj_input.variables["time"][start_i:end_i], dtype=np.float64)
+			if flag_box:
+				cell_lengths = np.array(obj_input.variables["cell_lengths"][start_i:end_i], dtype=np.float64)
+				cell_angles = np.array(obj_input.variables["cell_angles"][start_i:end_i], dtype=np.float64)
+
+				# unwrap atoms for centering
+				center_coords = coords[:, center_index]
+				previous = unwrap_atoms(center_coords, cell_lengths, previous).copy()
+				coords[:, center_index] = center_coords
+
+			center = np.einsum("fai,a->fi", coords[:, center_index], center_weights) / np.sum(center_weights)
+			coords -= center[:, None, :]
+
+			if flag_box:
+				coords = image_molecules(coords, cell_lengths, masses, molecule_index, n_molecule)
+
+			if reference is None:
+				reference = coords[0, center_index].copy()
+			coords = fit_frames(coords, center_index, center_weights, reference)
+
+			# write slab as records
+			records = np.empty(end_i - start_i, dtype=record_dtype)
+			records["coordinates"] = coords[:, keep_index]
+			if flag_time:
+				records["time"] = times
+			if flag_box:
+				records["cell_lengths"] = cell_lengths
+				records["cell_angles"] = cell_angles
+			obj_output.write(records.tobytes())
+			del coords, records
+
+		obj_output.seek(NUMRECS_OFFSET)
+		obj_output.write(struct.pack(">i", n_frame))
+		sys.stderr.write("done.\n")
+
+	finally:
+		var_coords = None
+		if obj_output is not None:
+			obj_output.close()
+		obj_input.close()
+
+	return n_frame
@@ -12,11 +12,14 @@ import os
 import argparse
 import subprocess
 import tempfile
+import glob
 from termcolor import colored
 import parmed
 
 from mods.func_prompt_io import *
 from mods.file_NDX import FileNDX
+from mods.func_nc_trajectory import check_nc_convertible, convert_nc
+from mods.file_XTC import FileXTC
 
 
 global delete_files
@@ -90,13 +93,17 @@ def check_command(command_name):
 	return command_path
 
 
-def exec_sp(command, operation=False):
+def exec_sp(command, operation=False, flag_exit=True):
 	"""
 	Function to execute outer program by subprocess module
 
 	Args:
 		command (str): command line
 		operation (bool, optional): show prompt (Default: False)
+		flag_exit (bool, optional): exit if subprocess failed (Default: True)
+
+	Returns:
+		int: return code
 	"""
 	if operation:
 		process = subprocess.Popen(
@@ -112,10 +119,12 @@ def exec_sp(command, operation=False):
 		)
 	streamdata = process.communicate()
 
-	if process.returncode == 1:
+	if process.returncode == 1 and flag_exit:
 		sys.stderr.write("ERROR: subprocess failed\n    '{0}'.\n".format(command))
 		sys.exit(1)
 
+	return process.returncode
+
 
 def output_mdp(output_file):
 	"""
@@ -134,7 +143,7 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description = "Program to convert Gromacs trajectory to AMBER trajectory", formatter_class=argparse.RawTextHelpFormatter)
 
 	parser.add_argument("-s", dest="TPR_FILE", metavar="INPUT.tpr", required=True, help="Gromacs run input file")
-	parser.add_argument("-x", dest="TRAJECTORY_FILE", metavar="INPUT.<trr|xtc|gro>", required=True, help="Gromacs trajectory file")
+	parser.add_argument("-x", dest="TRAJECTORY_FILES", metavar="INPUT.<trr|xtc|gro>", nargs="+", required=True, help="Gromacs trajectory file (multiple .xtc files or glob pattern are read as one trajectory, dropping frames with duplicated time)")
 	parser.add_argument("-o", dest="OUTPUT_FILE", metavar="OUTPUT.<nc|mdcrd|xtc|pdb>", required=True, help="output trajectory")
 	parser.add_argument("-t", dest="TOP_FILE", metavar="INPUT.top", required=True, help="Gromacs topology file")
 	parser.add_argument("-p", dest="PRMTOP_FILE", metavar="OUTPUT.prmtop", required=True, help="Amber topology file")
@@ -155,6 +164,7 @@ if __name__ == '__main__':
 	cpptraj_option.add_argument("--multi", dest="FLAG_MULTI", action="store_true", default=False, help="Output PDB file for each frame")
 	cpptraj_option.add_argument("--leave-atom", dest="LEAVE_MASK", metavar="LEAVE_ATOM_MASK", help="amber mask for leaving atoms (Use in cases where water molecules are left at a certain distance from biomolecules. Only .pdb output can be used. ex.: `:1-20<:5.0`)")
 	cpptraj_option.add_argument("--old", dest="USE_OLD_CPPTRAJ", action="store_true", default=False, help="use this option when use AmberTools <= 16")
+	cpptraj_option.add_argument("--cpptraj-nc", dest="FLAG_CPPTRAJ_NC", action="store_true", default=False, help="use cpptraj for .nc to .nc conversion instead of in-process conversion")
 
 	parser.add_argument("-O", dest="FLAG_OVERWRITE", action="store_true", default=False, help="overwrite forcibly")
 	parser.add_argument("--keep", dest="FLAG_KEEP", action="store_true", default=False, help="Leave intermediate files")
@@ -163,14 +173,36 @@ if __name__ == '__main__':
 
 	# check arguments
 	check_exist(args.TPR_FILE, 2)
-	check_exist(args.TRAJECTORY_FILE, 2)
+	trajectory_files = []
+	for pattern in args.TRAJECTORY_FILES:
+		matched_files = glob.glob(pattern)
+		if len(matched_files) == 0:
+			matched_files = [pattern]
+		trajectory_files.extend(matched_files)
+	# parts are read in file name order regardless of the order of arguments
+	trajectory_files = sorted(set(trajectory_files))
+	for trajectory_file in trajectory_files:
+		check_exist(trajectory_file, 2)
+	if len(trajectory_files) > 1 \
+		and any(os.path.splitext(v)[1].lower() != ".xtc" for v in trajectory_files):
+		sys.stderr.write("ERROR: multiple trajectory files are only supported for .xtc files.\n")
+		sys.exit(1)
+	args.TRAJECTORY_FILE = trajectory_files[0]
 	check_exist(args.TOP_FILE, 2)
+
+	# .nc to .nc conversion for orthogonal (or no) box is processed without cpptraj
+	flag_nc_to_nc = os.path.splitext(args.TRAJECTORY_FILE)[1].lower() == ".nc" \
+		and os.path.splitext(args.OUTPUT_FILE)[1].lower() == ".nc"
+	flag_fast_nc = False
+	if flag_nc_to_nc and not args.FLAG_CPPTRAJ_NC:
+		flag_fast_nc = check_nc_convertible(args.TRAJECTORY_FILE)
+
 	command_gmx = args.COMMAND_GMX
 	if command_gmx is None:
 		command_gmx = check_command(COMMAND_NAME_GMX)
 
 	command_cpptraj = args.COMMAND_CPPTRAJ
-	if command_cpptraj is None:
+	if command_cpptraj is None and not flag_fast_nc:
 		command_cpptraj = check_command(COMMAND_NAME_CPPTRAJ)
 
 	if os.path.splitext(args.OUTPUT_FILE)[1].lower() == ".xtc":
@@ -192,8 +224,7 @@ if __name__ == '__main__':
 
 	process_i = 0
 	max_process = None
-	if os.path.splitext(args.TRAJECTORY_FILE)[1].lower() == ".nc" \
-		and os.path.splitext(args.OUTPUT_FILE)[1].lower() == ".nc":
+	if flag_nc_to_nc:
 		max_process = 3
 	elif os.path.splitext(args.OUTPUT_FILE)[1].lower() == ".gro":
 		max_process = 11
@@ -253,9 +284,47 @@ if __name__ == '__main__':
 			step1_whole_trajectory = tempfile_name_full + "_step1_whole.xtc"
 		gmx_arg["-o"] = step1_whole_trajectory
 
-		command = " ".join([command_gmx, "trjconv"] + ["{0} {1}".format(o, v) for o, v in gmx_arg.items() if v is not None])
-		command += " " + gmx_eof
-		exec_sp(command, True)
+		if len(trajectory_files) == 1:
+			command = " ".join([command_gmx, "trjconv"] + ["{0} {1}".format(o, v) for o, v in gmx_arg.items() if v is not None])
+			command += " " + gmx_eof
+			exec_sp(command, True)
+
+		else:
+			# multiple parts are streamed into gmx through named pipe
+			obj_xtc = FileXTC(trajectory_files)
+			stream_file = tempfile_name_full + "_stream.xtc"
+			os.mkfifo(stream_file)
+			delete_files.append(stream_file)
+			stream_thread = obj_xtc.start_output_xtc(stream_file)
+			gmx_arg["-f"] = stream_file
+
+			command = " ".join([command_gmx, "trjconv"] + ["{0} {1}".format(o, v) for o, v in gmx_arg.items() if v is not None])
+			command += " " + gmx_eof
+			returncode = exec_sp(command, True, False)
+
+			# gmx has finished, so stop streaming also when gmx did not open named pipe
+			obj_xtc.stop()
+			stream_thread.join()
+			if obj_xtc.error is not None:
+				sys.stderr.write("ERROR: failed to read trajectory files ({0})\n".format(obj_xtc.error))
+				sys.exit(1)
+
+			if returncode != 0 or not obj_xtc.flag_opened:
+				# fall back to concatenated temporary file when gmx cannot read named pipe
+				sys.stderr.write("WARN: gmx could not read trajectory through named pipe. Concatenated temporary file is used.\n")
+				concat_file = tempfile_name_full + "_concat.xtc"
+				delete_files.append(concat_file)
+				obj_xtc.output_xtc(concat_file)
+				if obj_xtc.error is not None:
+					sys.stderr.write("ERROR: failed to read trajectory files ({0})\n".format(obj_xtc.error))
+					sys.exit(1)
+				gmx_arg["-f"] = concat_file
+
+				command = " ".join([command_gmx, "trjconv"] + ["{0} {1}".format(o, v) for o, v in gmx_arg.items() if v is not None])
+				command += " " + gmx_eof
+				exec_sp(command, True)
+
+			sys.stderr.write("INFO: {0} frames with duplicated time were dropped.\n".format(obj_xtc.n_duplicate))
 		if not args.FLAG_KEEP:
 			delete_files.append(step1_whole_trajectory)
 
@@ -399,10 +468,38 @@ if __name__ == '__main__':
 			sys.exit(0)
 
 
+	if flag_fast_nc:
+		# strip indices are determined by the topology before stripping
+		check_overwrite(args.PRMTOP_FILE, args.FLAG_OVERWRITE)
+		check_overwrite(args.OUTPUT_FILE, args.FLAG_OVERWRITE)
+
+		process_i += 1
+		sys.stdout.write(colored("Process ({0}/{1}): {2} => {3}\n".format(process_i, max_process, "Generate trajectory with rotated and shifted molecules.", args.OUTPUT_FILE), LOG_COLOR, attrs=["bold"]))
+		convert_nc(obj_topol, args.TRAJECTORY_FILE, args.OUTPUT_FILE, args.CENTER_MASK, args.STRIP_MASK)
+
+		process_i += 1
+		sys.stdout.write(colored("Process ({0}/{1}): {2} => {3}\n".format(process_i, max_process, "Generate prmtop", args.PRMTOP_FILE), LOG_COLOR, attrs=["bold"]))
+		if args.STRIP_MASK is not None:
+			obj_topol.strip(args.STRIP_MASK)
+		obj_topol.save(args.PRMTOP_FILE)
+
+		# delete temporary files
+		delete_all()
+		sys.exit(0)
+
+
 	# create .prmtop
 	process_i += 1
 	sys.stdout.write(colored("Process ({0}/{1}): {2} => {3}\n".format(process_i, max_process, "Generate prmtop", args.PRMTOP_FILE), LOG_COLOR, attrs=["bold"]))
 	check_overwrite(args.PRMTOP_FILE, args.FLAG_OVERWRITE)
+	parm_file = args.PRMTOP_FILE
+	if flag_nc_to_nc and args.STRIP_MASK is not None:
+		# cpptraj reads trajectory with topology before stripping
+		parm_file = tempfile_name_full + ".prmtop"
+		obj_topol.save(parm_file)
+		if not args.FLAG_KEEP:
+			delete_files.append(parm_file)
+		obj_topol.strip(args.STRIP_MASK)
 	obj_topol.save(args.PRMTOP_FILE)
 
 	# final conversion (rot+trans)
@@ -412,12 +509,14 @@ if __name__ == '__main__':
 	sys.stdout.write(colored("Process ({0}/{1}): {2} => {3}\n".format(process_i, max_process, "Generate trajectory with rotated and shifted molecules.", args.OUTPUT_FILE), LOG_COLOR, attrs=["bold"]))
 	temp_in = tempfile_name_full + ".in"
 	with open(temp_in, "w") as obj_output:
-		obj_output.write("parm {0}\n".format(args.PRMTOP_FILE))
+		obj_output.write("parm {0}\n".format(parm_file))
 		obj_output.write("trajin {0}\n".format(trajectory_input))
 		obj_output.write("unwrap {0}\n".format(args.CENTER_MASK))
 		obj_output.write("center {0} mass origin\n".format(args.CENTER_MASK))
 		obj_output.write("image origin center familiar\n")
 		obj_output.write("rms {0} first mass\n".format(args.CENTER_MASK))
+		if flag_nc_to_nc and args.STRIP_MASK is not None:
+			obj_output.write("strip {0}\n".format(args.STRIP_MASK))
 		if args.LEAVE_MASK is not None:
 			obj_output.write("mask {0} maskpdb {1}\n".format(args.LEAVE_MASK, args.OUTPUT_FILE))
 		else: